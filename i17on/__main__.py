@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import copy
 from i17on import translator
+from i17on.stats import Stats, StatsMismatch
+from i17on.cache import OutputCache
 
 
 def main(stdout=None, argv=None):
@@ -25,24 +28,36 @@ def main(stdout=None, argv=None):
         fname = argv.pop(0)
         with open(fname,'r') as f: text = f.read()
     
-    stdout.write(execute(text, argv))
+    execute(text, argv, stdout)
 
 
-def execute(text, argv=None):
+def execute(text, argv=None, out=None):
     """
     Takes normalized args and runs them through the translator.
 
+    The output is returned as a string, unless out (or --output) is
+    given, in which case it's written there as it's rendered.
+
     Text is the input (can come from a filename or from stdin), 
     argv is just a list of all the command-line arguments besides
     the input.
 
     Any arbitrary argument will be a tag, unless it's prepended by
-    --, in which case it will be a flag.  No verification is done
-    on invalid tags.
+    --, in which case it will be a flag, or it looks like name=value,
+    in which case it fills in the {=name} placeholder.  No verification
+    is done on invalid tags.
 
     Valid Tags:
 
         --debug: print the AST and brace matching
+        --stats=FILE: add branch hits and block timings from this
+            render to the JSON in FILE, which has to have been collected
+            from the same text
+        --report: with --stats, print a report of never-taken branches
+            and the hottest subtrees from FILE instead of rendering
+        --output=FILE: write the document to FILE instead
+        --output-cache=FILE: reuse documents already rendered from the
+            same text with the same tags, cached in the SQLite file FILE
 
     If the flags get more complicated, I'll write a more sophisticated
     argument parser.
@@ -50,18 +65,67 @@ def execute(text, argv=None):
     argv = argv or []
 
     # Grab the other args.
-    flags = []
+    flags = {}
     tags = []
+    values = {}
     for arg in argv:
         if arg[0:2] == '--':
-            flags.append(arg[2:])
+            name, _, value = arg[2:].partition('=')
+            flags[name] = value
+        elif '=' in arg:
+            name, _, value = arg.partition('=')
+            values[name] = value
         else:
             tags.append(arg)
 
     if 'debug' in flags:
         translator.debug_all = True
 
-    return translator.translate(text, tags)
+    if 'report' in flags and not flags.get('stats'):
+        sys.exit("i17on: --report needs --stats=FILE")
+
+    t = translator.Translator()
+    if flags.get('stats'):
+        t.stats = Stats()
+        if os.path.exists(flags['stats']):
+            # The report is on whatever is saved, whatever it came from.
+            source = None if 'report' in flags else text
+            with open(flags['stats'], 'r') as f:
+                try:
+                    t.stats.load(f.read(), source)
+                except StatsMismatch as e:
+                    sys.exit("i17on: %s: %s" % (flags['stats'], e))
+        if 'report' in flags:
+            if out is None:
+                return t.stats.report()
+            out.write(t.stats.report())
+            return
+
+    output = None
+    if flags.get('output-cache'):
+        # Cached output has to be built up in full to be stored anyway.
+        cache = OutputCache(flags['output-cache'])
+        try:
+            output = t.translate(text, tags=tags, values=values, cache=cache)
+        finally:
+            cache.close()
+        if flags.get('output'):
+            with open(flags['output'], 'w') as f: f.write(output)
+            output = None
+        elif out is not None:
+            out.write(output)
+            output = None
+    elif flags.get('output'):
+        with open(flags['output'], 'w') as f:
+            t.translate_into(f, text, tags=tags, values=values)
+    elif out is not None:
+        t.translate_into(out, text, tags=tags, values=values)
+    else:
+        output = t.translate(text, tags=tags, values=values)
+
+    if t.stats is not None:
+        with open(flags['stats'], 'w') as f: f.write(t.stats.to_json())
+    return output
 
 
 if __name__ == "__main__":
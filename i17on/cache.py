@@ -0,0 +1,143 @@
+import json
+import sqlite3
+import hashlib
+from collections.abc import Mapping
+from i17on import __version__
+
+NEXT_USE = 'SELECT COALESCE(MAX(used), 0) + 1 FROM outputs'
+
+
+class OutputCache():
+    """
+    A persistent cache of rendered documents in a local SQLite file,
+    which any number of processes can share.
+
+    Entries are keyed on a hash of the source text, the library version,
+    the tags which are set and any placeholder values.  Once the cached
+    output goes over `max_bytes`, the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Transactions are handled by hand so writes can take the lock
+        # up front with BEGIN IMMEDIATE.  `used` is a counter rather than a
+        # timestamp, so recency never ties.
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS outputs ('
+            'key TEXT PRIMARY KEY, output TEXT, size INTEGER, used INTEGER)')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS outputs_used ON outputs (used)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS counters ('
+            'name TEXT PRIMARY KEY, value INTEGER)')
+        self._db.execute(
+            "INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def key(self, text, tags=None, values=None):
+        """
+        Tags can be a list or a mapping, as for Translator.render().
+        Callables can't be cached, since there's no telling which tags
+        they'd say are set.
+        """
+        if callable(tags):
+            raise TypeError("Can't cache renders which use a tag resolver")
+        if isinstance(tags, Mapping):
+            tags = [tag for tag, value in tags.items() if value]
+        values = values or {}
+        key = json.dumps([
+            __version__,
+            hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            sorted(set(tags or [])),
+            sorted((name, str(value)) for name, value in values.items())
+        ])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached output for key, or None on a miss.
+        """
+        row = self._db.execute(
+            'SELECT output FROM outputs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            self._count('misses')
+            return None
+        self.hits += 1
+        with Transaction(self._db):
+            self._db.execute(
+                'UPDATE outputs SET used = (%s) WHERE key = ?' % NEXT_USE, (key,))
+            self._db.execute(
+                "UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+        return row[0]
+
+    def put(self, key, output):
+        size = len(output.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with Transaction(self._db):
+            self._db.execute(
+                'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, (%s))' % NEXT_USE,
+                (key, output, size))
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM outputs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        rows = self._db.execute('SELECT key, size FROM outputs ORDER BY used')
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._db.executemany('DELETE FROM outputs WHERE key = ?', victims)
+
+    def _count(self, name):
+        with Transaction(self._db):
+            self._db.execute(
+                'UPDATE counters SET value = value + 1 WHERE name = ?', (name,))
+
+    def stats(self):
+        """
+        Returns hits and misses for this instance, alongside the totals
+        across every process which has used the cache file.
+        """
+        counters = dict(self._db.execute('SELECT name, value FROM counters'))
+        entries, size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outputs').fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': counters['hits'],
+            'total_misses': counters['misses'],
+            'entries': entries,
+            'bytes': size
+        }
+
+    def clear(self):
+        with Transaction(self._db):
+            self._db.execute('DELETE FROM outputs')
+            self._db.execute('UPDATE counters SET value = 0')
+
+    def close(self):
+        self._db.close()
+
+
+class Transaction():
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, error, *_):
+        self.db.execute('ROLLBACK' if error else 'COMMIT')
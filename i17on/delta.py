@@ -0,0 +1,68 @@
+from i17on.translator import needs_space
+
+
+def export_variants(translator, tree, base_tags, variants, values=None):
+    """
+    Renders one base variant of a compiled tree in full, plus a patch for
+    each of the other variants.
+
+    `variants` maps a name to the tags for that variant, in any form
+    `Translator.render()` accepts.  Returns a dict which can be stored as
+    JSON:
+
+        {"base": skeleton, "patches": {name: patch, ...}}
+
+    Any variant can be rebuilt with `apply_patch(base, patch)`.
+    """
+    base = translator.render_skeleton(tree, base_tags, values)
+    patches = {}
+    for name, tags in variants.items():
+        variant = translator.render_skeleton(tree, tags, values)
+        patches[name] = diff(base, variant)
+    return {'base': base, 'patches': patches}
+
+
+def diff(base, variant, patch=None):
+    """
+    Compares two skeletons of the same tree and returns a patch, mapping
+    node ids (as strings, so the patch survives JSON) to the variant's
+    entry for every outermost BRANCH or FILTER node whose output changed.
+    """
+    if patch is None:
+        patch = {}
+    for old, new in zip(base, variant):
+        if isinstance(old, str):
+            continue
+        if len(old) == 2:  # FILTER
+            if old[1] != new[1]:
+                patch[str(old[0])] = new
+        elif old[1] != new[1]:  # BRANCH which picked another clause
+            patch[str(old[0])] = new
+        else:
+            diff(old[2], new[2], patch)
+    return patch
+
+
+def apply_patch(base, patch=None):
+    """
+    Rebuilds the text of a variant from the base skeleton and its patch.
+    Without a patch, this just gives the text of the base variant.
+    """
+    return join_skeleton(base, patch or {})
+
+
+def join_skeleton(entries, patch):
+    output = []
+    for entry in entries:
+        if not isinstance(entry, str):
+            entry = patch.get(str(entry[0]), entry)
+            if len(entry) == 2:  # FILTER
+                entry = entry[1]
+            else:
+                entry = join_skeleton(entry[2], patch)
+        if entry == '':
+            continue
+        if len(output) > 0 and needs_space(output[-1], entry):
+            output.append(' ')
+        output.append(entry)
+    return ''.join(output)
@@ -0,0 +1,290 @@
+"""
+Packs many compiled templates into a single file which worker processes
+can share through mmap.
+
+Layout, all little-endian 32-bit words:
+
+    header      magic, version, and the offset and size of each table
+    templates   (name, code offset, code length) per template
+    strings     offsets into the string data, one more than there are
+                strings, followed by the UTF-8 string data itself
+    code        the compiled trees, with every string replaced by its
+                index in the string table
+
+Nothing is decoded until a template is first asked for, so each worker
+only holds the trees it has actually rendered.  Everything else stays in
+pages shared with the other workers.
+"""
+
+import os
+import sys
+import mmap
+import array
+import struct
+import tempfile
+from i17on.translator import Translator
+
+MAGIC = b'I17P'
+VERSION = 1
+HEADER = struct.Struct('<4s7I')
+
+# Opcodes in the code table.
+TEXT, SLOT, BRANCH, FILTER, REF = range(5)
+ALWAYS = 0xFFFFFFFF  # Stands in for the count of a condition that's True.
+
+
+class PackError(Exception): pass
+
+
+def write_pack(path, templates, translator=None):
+    """
+    Compiles a mapping of names to template text (or already compiled
+    trees) and writes them to path as a pack.  The file is replaced
+    atomically, so workers can keep serving the old pack meanwhile.
+    """
+    translator = translator or Translator()
+    strings = {}
+    code = array.array('I')
+    index = []
+
+    def string(s):
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    for name, tree in sorted(templates.items()):
+        if isinstance(tree, str):
+            tree = translator.get_blocks(tree)
+        start = len(code)
+        encode_blocks(code, tree, string, {})
+        index.append((string(name), start, len(code) - start))
+
+    if sys.byteorder == 'big':
+        code.byteswap()
+    string_data = [s.encode('utf-8') for s in strings]
+    offsets = array.array('I', [0])
+    for data in string_data:
+        offsets.append(offsets[-1] + len(data))
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    string_data = b''.join(string_data)
+    string_data += b'\0' * (-len(string_data) % 4)  # Keep code aligned.
+
+    templates_at = HEADER.size
+    offsets_at = templates_at + len(index) * 12
+    data_at = offsets_at + len(offsets) * 4
+    code_at = data_at + len(string_data)
+    header = HEADER.pack(
+        MAGIC, VERSION, len(index), len(strings),
+        templates_at, offsets_at, data_at, code_at
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            for entry in index:
+                f.write(struct.pack('<3I', *entry))
+            f.write(offsets.tobytes())
+            f.write(string_data)
+            f.write(code.tobytes())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def encode_blocks(code, blocks, string, seen):
+    code.append(len(blocks))
+    for node in blocks:
+        encode_node(code, node, string, seen)
+
+
+def encode_node(code, node, string, seen):
+    # Shared subtrees are written once and referred back to after that.
+    if id(node) in seen:
+        code.extend((REF, seen[id(node)]))
+        return
+    if node[0] == 'TEXT':
+        code.extend((TEXT, string(node[1])))
+    elif node[0] == 'SLOT':
+        code.extend((SLOT, string(node[1])))
+    elif node[0] == 'BRANCH':
+        seen[id(node)] = len(code)
+        code.extend((BRANCH, len(node[1])))
+        for clause in node[1]:
+            if clause[1] is True:
+                code.append(ALWAYS)
+            else:
+                code.append(len(clause[1]))
+                for group in clause[1]:
+                    code.append(len(group))
+                    code.extend(string(tag) for tag in group)
+            encode_blocks(code, clause[2], string, seen)
+    elif node[0] == 'FILTER':
+        seen[id(node)] = len(code)
+        code.extend((FILTER, string(node[1]), len(node[2])))
+        code.extend(string(param) for param in node[2])
+        encode_node(code, node[3], string, seen)
+    else:
+        raise ValueError("unknown node type: ", node[0])
+
+
+class Pack():
+    """
+    A read-only pack opened through mmap.  Trees are decoded the first
+    time they're asked for and kept after that.
+    """
+
+    def __init__(self, path, translator=None):
+        self.translator = translator or Translator()
+        self._code = self._offsets = None
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise PackError("Not an i17on pack: " + path)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_tables(path)
+        except BaseException:
+            self.close()
+            raise
+        self._trees = {}
+
+    def _read_tables(self, path):
+        size = len(self._map)
+        header = HEADER.unpack_from(self._map)
+        if header[0] != MAGIC or header[1] != VERSION:
+            raise PackError("Not an i17on pack: " + path)
+        count, string_count, templates_at, offsets_at, data_at, code_at = header[2:]
+        # Check every table fits in the file before reading any of it.
+        if not (HEADER.size <= templates_at
+                and templates_at + count * 12 <= offsets_at
+                and offsets_at + (string_count + 1) * 4 <= data_at
+                and data_at <= code_at <= size):
+            raise PackError("Corrupt pack: tables don't fit in " + path)
+        self._data_at = data_at
+        self._offsets = self._words(offsets_at, string_count + 1)
+        if data_at + self._offsets[-1] > code_at:
+            raise PackError("Corrupt pack: bad string table in " + path)
+        self._code = self._words(code_at, (size - code_at) // 4)
+        self._strings = {}
+        self._index = {}
+        for i in range(count):
+            name, start, length = struct.unpack_from(
+                '<3I', self._map, templates_at + i * 12)
+            if name >= string_count or start + length > len(self._code):
+                raise PackError("Corrupt pack: bad template table in " + path)
+            try:
+                self._index[self.string(name)] = (start, length)
+            except UnicodeDecodeError:
+                raise PackError("Corrupt pack: bad string table in " + path)
+
+    def _words(self, start, count):
+        words = memoryview(self._map)[start:start + count * 4].cast('I')
+        if sys.byteorder == 'big':
+            words = array.array('I', words)
+            words.byteswap()
+        return words
+
+    def string(self, i):
+        if i not in self._strings:
+            start = self._data_at + self._offsets[i]
+            end = self._data_at + self._offsets[i + 1]
+            self._strings[i] = str(self._map[start:end], 'utf-8')
+        return self._strings[i]
+
+    def names(self):
+        return sorted(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, name):
+        """
+        Returns the compiled tree for a template, decoding it on the first
+        call.  Raises KeyError for names which aren't in the pack, and
+        PackError if its code is corrupt.
+        """
+        if name not in self._trees:
+            start, length = self._index[name]
+            try:
+                tree, end = self.decode_blocks(start, {})
+            except (IndexError, KeyError, ValueError):
+                # Reading past the code, a REF to something that hasn't
+                # been decoded, or a string that isn't valid UTF-8.
+                raise PackError("Corrupt pack: bad code for " + name)
+            if end != start + length:
+                raise PackError("Corrupt pack: bad code for " + name)
+            self._trees[name] = tree
+        return self._trees[name]
+
+    def render(self, name, tags=None, values=None):
+        return self.translator.render(self.get(name), tags, values)
+
+    def decode_blocks(self, pos, seen):
+        code = self._code
+        blocks = []
+        count = code[pos]
+        pos += 1
+        for _ in range(count):
+            node, pos = self.decode_node(pos, seen)
+            blocks.append(node)
+        return blocks, pos
+
+    def decode_node(self, pos, seen):
+        code = self._code
+        start = pos
+        op = code[pos]
+        if op == TEXT:
+            return ('TEXT', self.string(code[pos + 1])), pos + 2
+        if op == SLOT:
+            return ('SLOT', self.string(code[pos + 1])), pos + 2
+        if op == REF:
+            return seen[code[pos + 1]], pos + 2
+        if op == BRANCH:
+            clauses = []
+            count = code[pos + 1]
+            pos += 2
+            for _ in range(count):
+                groups = code[pos]
+                pos += 1
+                if groups == ALWAYS:
+                    condition = True
+                else:
+                    condition = []
+                    for _ in range(groups):
+                        terms = code[pos]
+                        condition.append([
+                            self.string(i) for i in code[pos + 1:pos + 1 + terms]
+                        ])
+                        pos += 1 + terms
+                blocks, pos = self.decode_blocks(pos, seen)
+                clauses.append(('WHEN', condition, blocks))
+            node = ('BRANCH', clauses)
+        elif op == FILTER:
+            name = self.string(code[pos + 1])
+            count = code[pos + 2]
+            params = [self.string(i) for i in code[pos + 3:pos + 3 + count]]
+            branch, pos = self.decode_node(pos + 3 + count, seen)
+            node = ('FILTER', name, params, branch)
+        else:
+            raise PackError("Corrupt pack: unknown opcode %d" % op)
+        seen[start] = node
+        return node, pos
+
+    def close(self):
+        self._trees = {}
+        for words in (self._code, self._offsets):
+            if isinstance(words, memoryview):
+                words.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
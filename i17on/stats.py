@@ -0,0 +1,200 @@
+import json
+import hashlib
+from i17on.translator import number_nodes
+
+
+class StatsMismatch(Exception): pass
+
+
+class Stats():
+    """
+    Collects branch coverage and timing across many renders of one
+    document.
+
+    Attach an instance to `Translator.stats` before compiling.  Nodes are
+    numbered with `number_nodes()`, so recompiling the same document gives
+    the same ids and counts from earlier runs can be merged with `load()`.
+
+    Identical snippets are compiled into one shared subtree, so their
+    hits are pooled and they're reported with every line they appear on.
+
+    Counts are tied to a hash of the document's text, so they're never
+    merged into counts for a different or edited document.
+    """
+
+    def __init__(self):
+        self.renders = 0
+        self.source = None  # Hash of the text the counts are for, if known.
+        self.nodes = []
+        self.blocks = []
+        self._tree = None
+        self._entries = {}  # id(node) -> node entry
+
+    def register(self, tree, lines=None, source=None):
+        """
+        Numbers the nodes in a compiled tree.  `lines` maps node ids to
+        the source lines they were compiled from, and `source` is the text
+        it was compiled from.  Counts already held for a node are kept as
+        long as it still has the same shape, unless they were for another
+        text, in which case everything starts again from zero.
+        """
+        lines = lines or {}
+        old_nodes = self.nodes
+        old_blocks = self.blocks
+        if source is not None:
+            source = source_hash(source)
+            if self.source is not None and self.source != source:
+                old_nodes = []
+                old_blocks = []
+                self.renders = 0
+            self.source = source
+        self.nodes = []
+        self.blocks = []
+        self._entries = {}
+        self._tree = tree
+
+        for node in number_nodes(tree):
+            clauses = node[1] if node[0] == 'BRANCH' else node[3][1]
+            entry = {
+                'id': len(self.nodes),
+                'type': node[0],
+                'lines': sorted(set(lines.get(id(node), []))),
+                'clauses': [{
+                    'condition': describe_condition(c[1]),
+                    'lines': sorted(set(lines.get(id(c), []))),
+                    'hits': 0
+                } for c in clauses]
+            }
+            old = old_nodes[entry['id']] if entry['id'] < len(old_nodes) else None
+            if old is not None and old['type'] == entry['type'] \
+                    and len(old['clauses']) == len(entry['clauses']):
+                for new_clause, old_clause in zip(entry['clauses'], old['clauses']):
+                    new_clause['hits'] = old_clause['hits']
+            self.nodes.append(entry)
+            # Identical clauses share one node, so they're told apart by
+            # their index within the node rather than by identity.
+            self._entries[id(node)] = entry
+
+        for i, node in enumerate(tree):
+            seconds = 0.0
+            if i < len(old_blocks) and old_blocks[i]['type'] == node[0]:
+                seconds = old_blocks[i]['seconds']
+            self.blocks.append({
+                'index': i,
+                'type': node[0],
+                'lines': sorted(set(lines.get(id(node), []))),
+                'seconds': seconds
+            })
+
+    def begin_render(self, tree):
+        if tree is not self._tree:
+            self.register(tree)
+        self.renders += 1
+
+    def hit(self, node, index):
+        self._entries[id(node)]['clauses'][index]['hits'] += 1
+
+    def block_time(self, index, seconds):
+        self.blocks[index]['seconds'] += seconds
+
+    def never_taken(self):
+        """
+        Returns (node, clause) entry pairs for clauses which haven't been
+        hit in any render.
+        """
+        return [
+            (node, clause)
+            for node in self.nodes
+            for clause in node['clauses']
+            if clause['hits'] == 0
+        ]
+
+    def hottest(self, count=10):
+        """
+        Returns the `count` top-level blocks which took the longest to
+        render, slowest first.
+        """
+        blocks = sorted(self.blocks, key=lambda b: b['seconds'], reverse=True)
+        return [b for b in blocks[:count] if b['seconds'] > 0]
+
+    def to_json(self):
+        return json.dumps({
+            'source': self.source,
+            'renders': self.renders,
+            'nodes': self.nodes,
+            'blocks': self.blocks
+        }, indent=2)
+
+    def load(self, data, source=None):
+        """
+        Takes the output of `to_json()` from an earlier run.  If a tree
+        has already been registered, the counts are merged into it.
+
+        Raises StatsMismatch if the counts were collected from a different
+        text than `source` or the tree already registered.
+        """
+        data = json.loads(data)
+        if source is not None:
+            source = source_hash(source)
+        saved = data.get('source')
+        for expected in (source, self.source):
+            if saved is not None and expected is not None and saved != expected:
+                raise StatsMismatch("Stats were collected from a different document")
+        self.source = self.source or saved or source
+        self.renders += data['renders']
+        if self._tree is None:
+            self.nodes = data['nodes']
+            self.blocks = data['blocks']
+            return
+        for old, node in zip(data['nodes'], self.nodes):
+            if old['type'] == node['type'] \
+                    and len(old['clauses']) == len(node['clauses']):
+                for old_clause, clause in zip(old['clauses'], node['clauses']):
+                    clause['hits'] += old_clause['hits']
+        for old, block in zip(data['blocks'], self.blocks):
+            if old['type'] == block['type']:
+                block['seconds'] += old['seconds']
+
+    def report(self, count=10):
+        out = ["Renders: %d" % self.renders, "", "Never taken:"]
+        never = self.never_taken()
+        for node, clause in never:
+            out.append("  %s {%s} (%s %d)" % (
+                describe_lines(clause['lines'] or node['lines']),
+                clause['condition'] or '(default)',
+                node['type'].lower(),
+                node['id']
+            ))
+        if len(never) == 0:
+            out.append("  (none)")
+        out += ["", "Hottest subtrees:"]
+        hottest = self.hottest(count)
+        for block in hottest:
+            share = block['seconds'] / max(self.renders, 1)
+            out.append("  %s %s %.6fs total, %.6fs per render" % (
+                describe_lines(block['lines']),
+                block['type'].lower(),
+                block['seconds'],
+                share
+            ))
+        if len(hottest) == 0:
+            out.append("  (none)")
+        return '\n'.join(out) + '\n'
+
+
+def source_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def describe_condition(condition):
+    if condition is True:
+        return ''
+    return ';'.join(','.join(c) for c in condition)
+
+
+def describe_lines(lines):
+    if len(lines) == 0:
+        return 'line ?:'
+    if len(lines) == 1:
+        return 'line %d:' % lines[0]
+    return 'lines %s:' % ', '.join(map(str, lines))
@@ -1,20 +1,113 @@
+import io
 import re
 import sys
+import time
 import pprint
+import asyncio
+import itertools
+import contextlib
+import contextvars
+from collections.abc import Mapping
 
 debug_all = False  # Will override local debug settings.
 
+# A space goes between two expanded nodes when one ends and the next
+# starts like a word.
+words_end = re.compile(r'(\w|[.!?,\(\)\*#])$')
+words_start = re.compile(r'^(\w|[\(\)_\*#])')
+
+
+def translate(text, tags=None, values=None, cache=None):
+    return Translator().translate(text, tags=tags, values=values, cache=cache)
+
+
+def needs_space(before, after):
+    return bool(words_end.search(before) and words_start.search(after))
+
+
+class Writer():
+    """
+    Streams fragments to a write callable, putting spaces between them
+    the same way expand_tree() does.  Only the last couple of characters
+    written are kept, which is all the spacing rule looks at.
+
+    `joint` is set when the next fragment follows an earlier, non-empty
+    sibling, and so might need a space in front of it.
+    """
+
+    def __init__(self, write, max_output=None):
+        self.write = write
+        self.max_output = max_output
+        self.tail = ''
+        self.size = 0
+        self.joint = False
+
+    def emit(self, text):
+        if text == '':
+            return
+        if self.joint and needs_space(self.tail, text):
+            self.write(' ')
+            self.size += 1
+            self.tail = ' '
+        self.joint = False
+        self.size += len(text)
+        if self.max_output is not None and self.size > self.max_output:
+            raise LimitExceeded(
+                "Output longer than %d characters" % self.max_output)
+        self.write(text)
+        self.tail = (self.tail + text[-2:])[-2:]
+
+
+def number_nodes(tree):
+    """
+    Lists every distinct BRANCH and FILTER node in a compiled tree in the
+    order a depth-first walk first reaches them.  A node's position in
+    the list is its id, which stays the same every time the same text is
+    compiled.
+    """
+    nodes = []
+    seen = set()
+
+    def walk(blocks):
+        for node in blocks:
+            if node[0] not in ('BRANCH', 'FILTER') or id(node) in seen:
+                continue
+            seen.add(id(node))
+            nodes.append(node)
+            clauses = node[1] if node[0] == 'BRANCH' else node[3][1]
+            for clause in clauses:
+                walk(clause[2])
+
+    walk(tree)
+    return nodes
+
+
+# The RenderState for the render in progress, and the CompileState for
+# the compile in progress.  They live in context variables rather than on
+# the translator, so one translator can compile and render on any number
+# of threads and asyncio tasks at once.
+current_render = contextvars.ContextVar('current_render', default=None)
+current_compile = contextvars.ContextVar('current_compile', default=None)
 
-def translate(text, tags=None):
-    t = Translator()
-    if tags is not None:
-        t.add_tag(*tags)
-    return t.translate(text)
+
+@contextlib.contextmanager
+def rendering(state):
+    """
+    Makes state the current render's state for the duration of the block.
+    """
+    token = current_render.set(state)
+    try:
+        yield state
+    finally:
+        current_render.reset(token)
 
 
 class UnbalancedBraces(Exception): pass
 
 
+class LimitExceeded(Exception): pass
+
+
 def print_cursors(text, *indexes, colors=None):
     color = '\033['+str(";".join(map(str, colors) or []))+';m'
     reset = '\033[0m'
@@ -36,55 +129,344 @@ def print_cursors(text, *indexes, colors=None):
         print(line)
 
 
+class RenderState():
+    """
+    Scratch state for a single render of a compiled tree.
+
+    `memo` maps the id of each interned BRANCH or FILTER node to its
+    expansion.  The tags can't change partway through a render, so the
+    node id alone is enough to key it.
+
+    `resolver`, if set, is asked whether a tag is set the first time the
+    template tests it, and its answer is kept in `resolved`.
+
+    `values` fills in SLOT nodes.
+
+    `seen` holds the ids of nodes streamed once already, which get
+    expanded into `memo` if they come up again.
+    """
+
+    def __init__(self, time_limit=None, resolver=None, values=None):
+        self.memo = {}
+        self.seen = set()
+        self.values = values or {}
+        self.resolver = resolver
+        self.resolved = {}
+        self.timed = None  # The tree whose blocks get timed, if any.
+        self.deadline = None
+        if time_limit is not None:
+            self.deadline = time.monotonic() + time_limit
+
+
+class CompileState():
+    """
+    Scratch state for a single compile of some text.
+
+    `interned` maps the key of every node compiled so far to its canonical
+    node.  `lines` maps node ids to the source lines they were compiled
+    from, and is only kept when lines are being tracked.
+    """
+
+    def __init__(self, track_lines=False):
+        self.interned = {}
+        self.depth = 0
+        self.node_count = 0
+        self.lines = {} if track_lines else None
+
+
 class Translator():
 
     _include_tags = None
 
+    # Resource limits for untrusted input; None means unlimited.
+    max_depth = None  # Tags nested inside each other.
+    max_nodes = None  # Nodes compiled from a single text.
+    max_output = None  # Characters in any rendered tree.
+    time_limit = None  # Seconds allowed for a single render.
+
+    stats = None  # Optional stats.Stats collector.
+
+    # Where the async API compiles text; None means the event loop's
+    # default executor.
+    executor = None
+
     def __init__(self, **kwargs):
         self._include_tags = list(kwargs.keys())
+        self._compiling = {}  # Text -> future, for compiles in flight.
+
+    def __getstate__(self):
+        # Compiles in flight belong to this process's event loop.
+        state = self.__dict__.copy()
+        state['_compiling'] = {}
+        return state
 
     def add_tag(self, *tags):
         for tag in tags:
             if tag not in self._include_tags:
                 self._include_tags.append(tag)
 
-    def translate(self, text, debug=False):
+    def set_limits(self, max_depth=None, max_nodes=None, max_output=None,
+                   time_limit=None):
+        """
+        Guards compiling and rendering against pathological input.  Any
+        limit which is passed as None is lifted.  Going over a limit
+        raises LimitExceeded.
+        """
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_output = max_output
+        self.time_limit = time_limit
+
+    def translate(self, text, debug=False, *, tags=None, values=None,
+                  cache=None):
+        """
+        Compiles and renders text.  If a cache.OutputCache is given, the
+        output is looked up there first and stored there after.
+
+        Tags and everything after them are keyword-only, since the
+        module-level translate() takes tags second and debug doesn't.
+        """
+        if cache is not None:
+            key = cache.key(text, self._include_tags if tags is None else tags, values)
+            output = cache.get(key)
+            if output is not None:
+                return output
         tree = self.get_blocks(text, debug=debug)
         if debug_all or debug:
             pp = pprint.PrettyPrinter(indent=4)
             pp.pprint(tree)
-        return self.expand_tree(tree)
+        output = self.render(tree, tags, values)
+        if cache is not None:
+            cache.put(key, output)
+        return output
 
-    def get_blocks(self, text, debug=False):
+    def render(self, tree, tags=None, values=None):
+        """
+        Expands a compiled tree, expanding each distinct subtree at most
+        once.
+
+        Tags default to the ones added to the translator.  Otherwise they
+        can be a list of tags which are set, a mapping of tags to truthy
+        or falsy values, or a callable which takes a tag and says whether
+        it's set.  Mappings and callables are only consulted for tags the
+        template actually tests, at most once each per render.
+
+        Values maps placeholder names to what they should be filled with;
+        placeholders which aren't in it are left empty.
+        """
+        output = io.StringIO()
+        self.render_into(output, tree, tags, values)
+        return output.getvalue()
+
+    def translate_into(self, sink, text, debug=False, *, tags=None,
+                       values=None):
+        tree = self.get_blocks(text, debug=debug)
+        if debug_all or debug:
+            pp = pprint.PrettyPrinter(indent=4)
+            pp.pprint(tree)
+        self.render_into(sink, tree, tags, values)
+
+    def render_into(self, sink, tree, tags=None, values=None):
+        """
+        Renders a tree like render(), but writes the output to sink (a
+        file, socket file, io.StringIO or anything else with a write()
+        method) as it goes, rather than building it up in memory.
+        """
+        state = self.start_render(tags, values)
+        if self.stats is not None:
+            self.stats.begin_render(tree)
+            state.timed = tree
+        with rendering(state):
+            self.write_tree(tree, Writer(sink.write, self.max_output))
+
+    def render_blocks(self, tree, tags=None, values=None):
+        """
+        Renders a tree one top-level block at a time, yielding the output
+        of every block which isn't empty.
+
+        The render's state is only made current while a block is
+        rendering, so any number of these can be interleaved on one
+        translator.
+        """
+        chunks = []
+        writer = Writer(chunks.append, self.max_output)
+        state = self.start_render(tags, values)
+        if self.stats is not None:
+            self.stats.begin_render(tree)
+        for i, node in enumerate(tree):
+            if writer.size > 0:
+                writer.joint = True
+            started = time.perf_counter()
+            with rendering(state):
+                self.write_node(node, writer)
+            if self.stats is not None:
+                self.stats.block_time(i, time.perf_counter() - started)
+            if len(chunks) > 0:
+                suspended = time.monotonic()
+                yield ''.join(chunks)
+                chunks.clear()
+                # Only time spent rendering counts against the time limit,
+                # not time spent waiting on whoever's consuming the output.
+                if state.deadline is not None:
+                    state.deadline += time.monotonic() - suspended
+
+    async def compile_async(self, text):
+        """
+        Compiles text on the translator's executor, so the event loop can
+        carry on meanwhile.  Concurrent calls for the same text share a
+        single compile.
+        """
+        if text not in self._compiling:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self.get_blocks, text)
+            self._compiling[text] = future
+            future.add_done_callback(lambda _: self._compiling.pop(text, None))
+        # Shielded, so one caller giving up doesn't cancel the others.
+        return await asyncio.shield(self._compiling[text])
+
+    async def iter_render_async(self, template, tags=None, values=None):
+        """
+        Renders template, which is either text or an already compiled
+        tree, yielding the output one top-level block at a time and
+        handing control back to the event loop in between.
+        """
+        tree = template
+        if isinstance(template, str):
+            tree = await self.compile_async(template)
+        for chunk in self.render_blocks(tree, tags, values):
+            yield chunk
+            await asyncio.sleep(0)
+
+    async def render_async(self, template, tags=None, values=None):
+        chunks = []
+        async for chunk in self.iter_render_async(template, tags, values):
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def render_skeleton(self, tree, tags=None, values=None):
+        """
+        Renders a tree the same way as render(), but keeps the structure
+        of the output.  Every top-level block becomes an entry:
+
+            TEXT and SLOT nodes: the expanded string
+            BRANCH nodes: [node id, clause index, entries for the clause]
+            FILTER nodes: [node id, the expanded string]
+
+        Node ids come from number_nodes().  A BRANCH with no matching
+        clause has a clause index of None and no entries.
+
+        Counts as a render for the stats collector, if there is one.
+        """
+        ids = {id(node): i for i, node in enumerate(number_nodes(tree))}
+        if self.stats is not None:
+            self.stats.begin_render(tree)
+        with rendering(self.start_render(tags, values)):
+            return self.skeleton_tree(tree, ids)
+
+    def skeleton_tree(self, tree, ids):
         output = []
-        start, end = self.outer_braces(text)
-        if start is not None:
+        for node in tree:
+            if node[0] == 'BRANCH':
+                entry = [ids[id(node)], None, []]
+                i = self.pick_clause(node[1])
+                if i is not None:
+                    if self.stats is not None:
+                        self.stats.hit(node, i)
+                    entry[1:] = [i, self.skeleton_tree(node[1][i][2], ids)]
+            elif node[0] == 'FILTER':
+                entry = [ids[id(node)], self.expand_node(node) or '']
+            else:
+                entry = self.expand_node(node) or ''
+            output.append(entry)
+        return output
+
+    def start_render(self, tags=None, values=None):
+        """
+        Returns a fresh RenderState for rendering with tags and values.
+        Wrap the expansion in `with rendering(state):` to use it.
+        """
+        resolver = None
+        if callable(tags):
+            resolver = tags
+        elif isinstance(tags, Mapping):
+            resolver = tags.get
+        elif tags is not None:
+            resolver = set(tags).__contains__
+        return RenderState(
+            time_limit=self.time_limit,
+            resolver=resolver,
+            values=values
+        )
+
+    def get_blocks(self, text, debug=False, line=None):
+        """
+        Lexes text into a list of nodes, walking it left to right.
+
+        Each span of literal text between tags is squashed exactly once,
+        as it is emitted, and spans which squash down to nothing are
+        dropped rather than compiled.
+
+        Structurally identical subtrees within the text are interned, so
+        repeated snippets share a single node.
+
+        `line` is the source line text starts on.  Lines are only tracked
+        for the benefit of the stats collector.
+        """
+        if current_compile.get() is None:
+            state = CompileState(track_lines=self.stats is not None)
+            if self.stats is not None:
+                line = line or 1
+            token = current_compile.set(state)
+            try:
+                tree = self.get_blocks(text, debug=debug, line=line)
+            finally:
+                current_compile.reset(token)
+            if self.stats is not None:
+                self.stats.register(tree, state.lines, text)
+            return tree
+        output = []
+        while True:
+            start, end = self.outer_braces(text)
+            if start is None:
+                break
             if start > 0:  # Leading
-                leading = self.squash_whitespace(text[0:start])
-                if leading != '':
-                    output += [self.compile_text(leading)]
-            output += [self.compile_tag(text[start + 1:end])]
-            if len(text) > end + 1:  # Trailing
-                trailing = self.squash_whitespace(text[end + 1:])
-                if trailing != '':
-                    output += self.get_blocks(text[end + 1:])
-        else:
-            output += [self.compile_text(text)]
+                self.emit_text(output, text[0:start], line)
+            if line is not None:
+                line += text.count('\n', 0, start)
+            output.append(self.compile_tag(text[start + 1:end], line))
+            if line is not None:
+                line += text.count('\n', start, end + 1)
+            text = text[end + 1:]
+        self.emit_text(output, text, line)  # Trailing
         return output
 
+    def emit_text(self, output, text, line=None):
+        node = self.compile_text(text)
+        if node is not None:
+            if line is not None:
+                # Point at the first line with something on it.
+                line += text.count('\n', 0, len(text) - len(text.lstrip()))
+            output.append(self.intern(node, node, line))
+
     def compile_text(self, text):
         text = self.squash_whitespace(text)
-        if text is '':
+        if text == '':
             return None
         return ("TEXT", text)
 
-    def compile_tag(self, text):
+    def compile_tag(self, text, line=None):
         if re.match(r'^@\w+(\(*.\))?:', text):
-            return self.compile_filter(text)
+            return self.compile_filter(text, line)
+        elif re.match(r'^=\s*[\w.-]+\s*$', text):
+            return self.compile_slot(text, line)
         else:
-            return self.compile_branch(text)
+            return self.compile_branch(text, line)
 
-    def compile_filter(self, text):
+    def compile_slot(self, text, line=None):
+        node = ('SLOT', text[1:].strip())
+        return self.intern(node, node, line)
+
+    def compile_filter(self, text, line=None):
         colon = text.index(':')
         filter_name = text[1:colon]
         start, end = self.outer_braces(filter_name, '(', ')')
@@ -93,25 +475,74 @@ class Translator():
             filter_name = filter_name[0:start]
         else:
             params = []
-        branch = self.compile_branch(text[colon + 2:-1])
-        return ('FILTER', filter_name, params, branch)
-
-    def compile_branch(self, text):
+        inner_line = None
+        if line is not None:
+            inner_line = line + text.count('\n', 0, colon + 2)
+        branch = self.compile_branch(text[colon + 2:-1], inner_line)
+        node = ('FILTER', filter_name, params, branch)
+        key = ('FILTER', filter_name, tuple(params), id(branch))
+        return self.intern(key, node, line)
+
+    def compile_branch(self, text, line=None):
+        state = current_compile.get()
+        if state is not None:
+            state.depth += 1
+            if self.max_depth is not None and state.depth > self.max_depth:
+                raise LimitExceeded("Tags nested deeper than %d" % self.max_depth)
         branches = []
         text = self.escape_inner(text)
         clauses = text.split('|-')
+        clause_line = line
         for c in clauses:
+            # Clauses are pinned to the line their |- (or condition) is
+            # on.  Escaping never touches line breaks, so newlines counted
+            # in the escaped text line up with the source.
+            when_line = clause_line
+            if line is not None:
+                clause_line += c.count('\n')
             if ':' not in c.strip().split('\n')[0]:
                 condition = True
                 node = c
             else:
+                if line is not None:
+                    lead = len(c) - len(c.lstrip())
+                    when_line += c.count('\n', 0, lead)
                 c = c.lstrip()
                 breaker = c.split('\n')[0].index(':')
                 condition = self.compile_condition(c[0:breaker])
                 node = c[(breaker + 1):]
             node = self.unescape_inner(node)
-            branches.append(('WHEN', condition, self.get_blocks(node)))
-        return ('BRANCH', branches)
+            blocks = self.get_blocks(node, line=when_line)
+            if condition is True:
+                key = ('WHEN', True)
+            else:
+                key = ('WHEN', tuple(tuple(c) for c in condition))
+            key += tuple(id(b) for b in blocks)
+            when = ('WHEN', condition, blocks)
+            branches.append(self.intern(key, when, when_line))
+        key = ('BRANCH',) + tuple(id(b) for b in branches)
+        if state is not None:
+            state.depth -= 1
+        return self.intern(key, ('BRANCH', branches), line)
+
+    def intern(self, key, node, line=None):
+        """
+        Returns the canonical node for key, registering node as canonical
+        if it's the first of its kind seen in this compile.
+
+        Keys are built from the ids of already-interned children, so two
+        subtrees get the same key only if they're structurally identical.
+        """
+        state = current_compile.get()
+        if state is None:
+            return node
+        state.node_count += 1
+        if self.max_nodes is not None and state.node_count > self.max_nodes:
+            raise LimitExceeded("More than %d nodes" % self.max_nodes)
+        node = state.interned.setdefault(key, node)
+        if state.lines is not None and line is not None:
+            state.lines.setdefault(id(node), []).append(line)
+        return node
 
     def compile_condition(self, condition):
         output = []
@@ -164,59 +595,178 @@ class Translator():
     def unescape_inner(self, text, **kwargs):
         return self._escape(text, reverse=True, **kwargs)
 
+    def check_deadline(self):
+        deadline = current_render.get().deadline
+        if deadline is not None and time.monotonic() > deadline:
+            raise LimitExceeded(
+                "Render took longer than %ss" % self.time_limit)
+
+    def write_tree(self, tree, writer):
+        started = writer.size
+        # Top-level blocks get timed when stats are being collected.
+        timed = current_render.get().timed is tree
+        for i, node in enumerate(tree):
+            if writer.size > started:
+                writer.joint = True
+            if timed:
+                started_at = time.perf_counter()
+                self.write_node(node, writer)
+                self.stats.block_time(i, time.perf_counter() - started_at)
+            else:
+                self.write_node(node, writer)
+
+    def write_node(self, node, writer):
+        state = current_render.get()
+        self.check_deadline()
+        if node[0] == "TEXT":
+            writer.emit(node[1])
+        elif node[0] == "SLOT":
+            writer.emit(self.expand_slot(node))
+        elif id(node) in state.memo:
+            if self.stats is not None:
+                self.count_reuse(node)
+            writer.emit(state.memo[id(node)])
+        elif id(node) in state.seen or node[0] == "FILTER":
+            # Filters need all of their items before they can write
+            # anything, and nodes which come up more than once are only
+            # worth expanding once.
+            writer.emit(self.expand_node(node) or '')
+        elif node[0] == "BRANCH":
+            state.seen.add(id(node))
+            i = self.pick_clause(node[1])
+            if i is not None:
+                if self.stats is not None:
+                    self.stats.hit(node, i)
+                self.write_tree(node[1][i][2], writer)
+        else:
+            raise ValueError("unknown node type: ", node[0])
+
     def expand_node(self, node):
         txt = ""
+        memo = {}
+        state = current_render.get()
+        if state is not None:
+            memo = state.memo
+            self.check_deadline()
         if node[0] == "TEXT":
             txt = node[1]
+        elif node[0] == "SLOT":
+            txt = self.expand_slot(node)
+        elif id(node) in memo:
+            if self.stats is not None:
+                self.count_reuse(node)
+            txt = memo[id(node)]
         elif node[0] == "BRANCH":
-            txt = self.expand_branch(node)
+            txt = memo[id(node)] = self.expand_branch(node)
         elif node[0] == "FILTER":
-            txt = self.expand_filter(node)
+            txt = memo[id(node)] = self.expand_filter(node)
         else:
             raise ValueError("unknown node type: ", node[0])
         if txt == '':
             return None
         return txt
 
+    def count_reuse(self, node):
+        """
+        Records hits for the clauses a memoized node takes, and everything
+        taken inside them, since reusing its expansion skips all of that.
+        """
+        if node[0] == "BRANCH":
+            clauses = node[1]
+            i = self.pick_clause(clauses)
+            taken = [] if i is None else [i]
+        elif node[0] == "FILTER":
+            clauses = node[3][1]
+            taken = [
+                i for i, clause in enumerate(clauses)
+                if self.pick_clause([clause]) is not None
+            ]
+        else:
+            return
+        for i in taken:
+            self.stats.hit(node, i)
+            for child in clauses[i][2]:
+                self.count_reuse(child)
+
+    def expand_slot(self, node):
+        state = current_render.get()
+        if state is None:
+            return ""
+        value = state.values.get(node[1])
+        if value is None:
+            return ""
+        return str(value)
+
     def expand_filter(self, node):
         filter_name = node[1]
         params = node[2]
-        branch = node[3]
-        good = []
-        for clause in branch[1]:
-            condition = clause[1]
-            if type(condition) == bool:
-                condition = [condition]
-            if self.check_conditions(*condition) is True:
-                good.append(self.expand_tree(clause[2]))
-        if len(good) == 0:
+        items = self.filter_items(node)
+        first = next(items, None)
+        if first is None:
             return ""
         filter_method = getattr(self, 'filter_' + filter_name, None)
         if filter_method is None:
             raise Exception("Unknown filter: " + filter_name)
-        return filter_method(params, good)
+        return filter_method(params, itertools.chain([first], items))
+
+    def filter_items(self, node):
+        """
+        Lazily expands each clause of a filter whose condition is met.
+        """
+        for i, clause in enumerate(node[3][1]):
+            condition = clause[1]
+            if type(condition) == bool:
+                condition = [condition]
+            if self.check_conditions(*condition) is True:
+                if self.stats is not None:
+                    self.stats.hit(node, i)
+                yield self.expand_tree(clause[2])
 
     def expand_branch(self, node):
-        for clause in node[1]:
+        i = self.pick_clause(node[1])
+        if i is None:
+            return ""
+        if self.stats is not None:
+            self.stats.hit(node, i)
+        return self.expand_tree(node[1][i][2])
+
+    def pick_clause(self, clauses):
+        """
+        Returns the index of the first clause whose condition is met, or
+        None if there isn't one.
+        """
+        for i, clause in enumerate(clauses):
             condition = clause[1]
             if type(condition) == bool:
                 condition = [condition]
             if self.check_conditions(*condition) is True:
-                return self.expand_tree(clause[2])
-        return ""
+                return i
+        return None
 
     def expand_tree(self, tree):
         output = []
-        words_end = re.compile(r'(\w|[.!?,\(\)\*#])$')
-        words_start = re.compile(r'^(\w|[\(\)_\*#])')
-        for node in tree:
-            text = self.expand_node(node)
+        size = 0
+        # Top-level blocks get timed when stats are being collected.
+        state = current_render.get()
+        timed = state is not None and state.timed is tree
+        for i, node in enumerate(tree):
+            if timed:
+                started = time.perf_counter()
+                text = self.expand_node(node)
+                self.stats.block_time(i, time.perf_counter() - started)
+            else:
+                text = self.expand_node(node)
             if text is None:
                 continue
             if len(output) > 0:
-                if words_end.search(output[-1]) and words_start.search(text):
+                if needs_space(output[-1], text):
                     output.append(' ')
+                    size += 1
             output.append(text)
+            size += len(text)
+            if self.max_output is not None and size > self.max_output:
+                raise LimitExceeded(
+                    "Output longer than %d characters" % self.max_output)
         return ''.join(output)
 
     def check_conditions(self, *conditions):
@@ -236,7 +786,12 @@ class Translator():
         return match
 
     def condition_met(self, condition):
-        return condition in self._include_tags
+        state = current_render.get()
+        if state is None or state.resolver is None:
+            return condition in self._include_tags
+        if condition not in state.resolved:
+            state.resolved[condition] = bool(state.resolver(condition))
+        return state.resolved[condition]
 
     def squash_whitespace(self, text):
         o = []
@@ -270,6 +825,7 @@ class Translator():
         return output
 
     def filter_list(self, _, items):
+        items = list(items)
         if len(items) > 1:
             items[-1] = 'and '+items[-1]
         if len(items) > 2:
@@ -0,0 +1,111 @@
+"""
+Evaluates a compiled tree against many tag profiles at once.
+
+Needs NumPy, which can be installed with `pip install i17on[vector]`.
+"""
+
+from i17on.translator import number_nodes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("i17on.vector needs NumPy: pip install numpy")
+
+
+def evaluate(tree, tags, profiles):
+    """
+    Works out which clauses every profile would see.
+
+    `tags` names the columns of `profiles`, a boolean matrix with one row
+    per profile and one column per tag.  Tags the template tests which
+    aren't in `tags` are treated as unset.
+
+    Returns (clauses, selected).  `clauses` lists a (node id, clause
+    index) pair per column of `selected`, using the ids from
+    number_nodes().  `selected` is a boolean profile x clause matrix,
+    True where that clause fires and is actually reached for that profile.
+    A subtree shared between several places counts as reached if any of
+    them is.
+    """
+    require_numpy()
+    profiles = numpy.asarray(profiles, dtype=bool)
+    rows = profiles.shape[0]
+    columns = {tag: i for i, tag in enumerate(tags)}
+    nodes = number_nodes(tree)
+    clauses = []
+    offsets = {}
+    for i, node in enumerate(nodes):
+        offsets[id(node)] = len(clauses)
+        count = len(node[1] if node[0] == 'BRANCH' else node[3][1])
+        clauses += [(i, k) for k in range(count)]
+    selected = numpy.zeros((rows, len(clauses)), dtype=bool)
+    met = {}  # id(condition) -> profile vector
+
+    def term(tag):
+        negate = tag[0] == '!'
+        if negate:
+            tag = tag[1:]
+        if tag in columns:
+            vector = profiles[:, columns[tag]]
+        else:
+            vector = numpy.zeros(rows, dtype=bool)
+        return ~vector if negate else vector
+
+    def condition_met(condition):
+        if condition is True:
+            return numpy.ones(rows, dtype=bool)
+        if id(condition) not in met:
+            vector = numpy.zeros(rows, dtype=bool)
+            for group in condition:  # OR
+                vector |= numpy.logical_and.reduce(
+                    [term(tag) for tag in group])  # AND
+            met[id(condition)] = vector
+        return met[id(condition)]
+
+    def walk(blocks, visible):
+        for node in blocks:
+            if node[0] == 'BRANCH':
+                remaining = visible.copy()
+                for k, clause in enumerate(node[1]):
+                    hit = remaining & condition_met(clause[1])
+                    if not hit.any():
+                        continue
+                    selected[:, offsets[id(node)] + k] |= hit
+                    remaining &= ~hit
+                    walk(clause[2], hit)
+            elif node[0] == 'FILTER':
+                for k, clause in enumerate(node[3][1]):
+                    hit = visible & condition_met(clause[1])
+                    if not hit.any():
+                        continue
+                    selected[:, offsets[id(node)] + k] |= hit
+                    walk(clause[2], hit)
+
+    walk(tree, numpy.ones(rows, dtype=bool))
+    return clauses, selected
+
+
+def group_renders(translator, tree, tags, profiles, values=None):
+    """
+    Renders a tree once per distinct selection of clauses among the
+    profiles, rather than once per profile.
+
+    Returns a list of (text, profile indexes) pairs.
+    """
+    require_numpy()
+    profiles = numpy.asarray(profiles, dtype=bool)
+    _, selected = evaluate(tree, tags, profiles)
+    _, first, groups = numpy.unique(
+        selected, axis=0, return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    output = []
+    for group, row in enumerate(first):
+        profile = [tag for tag, on in zip(tags, profiles[row]) if on]
+        text = translator.render(tree, profile, values)
+        output.append((text, numpy.flatnonzero(groups == group)))
+    return output
@@ -1,6 +1,5 @@
 from setuptools import setup, find_packages
-
-VERSION = '0.1.1'
+from i17on import __version__ as VERSION
 
 config = {
     'description': "An intranationalization engine for dynamic Markdown documents.",
@@ -9,6 +8,9 @@ config = {
     'url': 'http://i17on.com',
     'version': VERSION,
     'packages': find_packages(exclude=["tests"]),
+    'extras_require': {
+        'vector': ['numpy']
+    },
     'entry_points': {
         "console_scripts": [
             'i17on = i17on.__main__:main'
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from i17on import cache
+from i17on import translator
+from i17on.cache import OutputCache
+
+TEXT = '{foo:hello|-bar:hi} world'
+
+
+class OutputCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'outputs.db')
+        self.cache = OutputCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_translate_hit_and_miss(self):
+        self.assertEqual(translator.translate(TEXT, ['foo'], cache=self.cache), 'hello world')
+        self.assertEqual(translator.translate(TEXT, ['foo'], cache=self.cache), 'hello world')
+        self.assertEqual(translator.translate(TEXT, ['bar'], cache=self.cache), 'hi world')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertEqual(stats['entries'], 2)
+
+    def test_cached_output_is_used(self):
+        key = self.cache.key(TEXT, ['foo'])
+        self.cache.put(key, 'from the cache')
+        self.assertEqual(translator.translate(TEXT, ['foo'], cache=self.cache), 'from the cache')
+
+    def test_tags_are_normalized(self):
+        key = self.cache.key(TEXT, ['b', 'a', 'a'])
+        self.assertEqual(key, self.cache.key(TEXT, ['a', 'b']))
+        self.assertEqual(key, self.cache.key(TEXT, {'a': True, 'b': 1, 'c': False}))
+        self.assertNotEqual(key, self.cache.key(TEXT, ['a']))
+        self.assertNotEqual(key, self.cache.key(TEXT + ' ', ['a', 'b']))
+        self.assertNotEqual(key, self.cache.key(TEXT, ['a', 'b'], {'v': 1}))
+        with mock.patch.object(cache, '__version__', '99'):
+            self.assertNotEqual(key, self.cache.key(TEXT, ['a', 'b']))
+        with self.assertRaises(TypeError):
+            self.cache.key(TEXT, lambda tag: True)
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.max_bytes = 30
+        for name in ('a', 'b', 'c'):
+            self.cache.put(name, name * 10)
+        self.assertEqual(self.cache.get('a'), 'a' * 10)
+        self.cache.put('d', 'd' * 10)
+        self.assertIsNone(self.cache.get('b'))
+        for name in ('a', 'c', 'd'):
+            self.assertEqual(self.cache.get(name), name * 10)
+        self.assertEqual(self.cache.stats()['bytes'], 30)
+
+    def test_shared_between_processes(self):
+        other = OutputCache(self.path)
+        try:
+            translator.translate(TEXT, ['foo'], cache=other)
+            translator.translate(TEXT, ['foo'], cache=self.cache)
+            stats = self.cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 0))
+            self.assertEqual((stats['total_hits'], stats['total_misses']), (1, 1))
+        finally:
+            other.close()
@@ -1,10 +1,69 @@
+import io
+import os
+import shutil
+import tempfile
 import unittest
 from i17on.__main__ import execute
+from i17on.cache import OutputCache
 
 class CommandlineTest(unittest.TestCase):
 
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
     def test_basic_use(self):
         output = execute('{foo:hello} world', ['foo'])
         self.assertEqual(output, 'hello world')
         output = execute('{foo:hello} world')
-        self.assertEqual(output, 'world')
\ No newline at end of file
+        self.assertEqual(output, 'world')
+
+    def test_stats_report(self):
+        path = os.path.join(self.dir, 'stats.json')
+        execute('{foo:hello|-bar:hi} world', ['foo', '--stats=' + path])
+        execute('{foo:hello|-bar:hi} world', ['--stats=' + path])
+        report = execute('', ['--stats=' + path, '--report'])
+        self.assertIn('Renders: 2', report)
+        self.assertIn('line 1: {bar} (branch 0)', report)
+
+    def test_stats_from_another_document(self):
+        path = os.path.join(self.dir, 'stats.json')
+        execute('{foo:hello|-bar:hi} world', ['foo', '--stats=' + path])
+        with open(path) as f:
+            saved = f.read()
+        with self.assertRaises(SystemExit):
+            execute('{foo:hello|-bar:hey} world', ['foo', '--stats=' + path])
+        with open(path) as f:
+            self.assertEqual(f.read(), saved)
+
+    def test_report_needs_stats(self):
+        with self.assertRaises(SystemExit):
+            execute('{foo:hello} world', ['foo', '--report'])
+
+    def test_values(self):
+        output = execute('{foo:Version {=version}}.', ['foo', 'version=2.1'])
+        self.assertEqual(output, 'Version 2.1.')
+
+    def test_streaming_output(self):
+        out = io.StringIO()
+        result = execute('{foo:hello} world', ['foo'], out)
+        self.assertIsNone(result)
+        self.assertEqual(out.getvalue(), 'hello world')
+
+    def test_output_file(self):
+        path = os.path.join(self.dir, 'out.md')
+        execute('{foo:hello} world', ['foo', '--output=' + path])
+        with open(path) as f:
+            self.assertEqual(f.read(), 'hello world')
+
+    def test_output_cache(self):
+        path = os.path.join(self.dir, 'outputs.db')
+        for _ in range(2):
+            output = execute('{foo:hello} world', ['foo', '--output-cache=' + path])
+            self.assertEqual(output, 'hello world')
+        cache = OutputCache(path)
+        stats = cache.stats()
+        cache.close()
+        self.assertEqual((stats['total_hits'], stats['total_misses']), (1, 1))
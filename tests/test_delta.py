@@ -0,0 +1,77 @@
+import json
+import unittest
+from i17on import translator
+from i17on.stats import Stats
+from i17on.delta import export_variants, apply_patch
+
+TEXT = """
+# Installing {=product}
+
+{windows:Run the installer.|-mac:Open the disk image.|-Use your package manager.}
+
+{beta:
+    You're on the beta, {windows:so expect crashes|-so expect bugs}.
+}
+
+Supported on {@list:{windows:Windows|-mac:macOS|-linux:Linux}}.
+
+{windows:Run the installer.|-mac:Open the disk image.|-Use your package manager.}
+"""
+
+VARIANTS = {
+    'windows': ['windows'],
+    'mac': {'mac': True},
+    'beta': ['beta'],
+    'beta-windows': ['beta', 'windows'],
+    'linux-beta': lambda tag: tag in ('linux', 'beta'),
+}
+
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.t = translator.Translator()
+        self.tree = self.t.get_blocks(TEXT)
+        self.values = {'product': 'i17on'}
+
+    def test_round_trip(self):
+        exported = export_variants(self.t, self.tree, [], VARIANTS, self.values)
+        # Patches need to survive being stored.
+        exported = json.loads(json.dumps(exported))
+        self.assertEqual(
+            apply_patch(exported['base']),
+            self.t.render(self.tree, [], self.values)
+        )
+        for name, tags in VARIANTS.items():
+            self.assertEqual(
+                apply_patch(exported['base'], exported['patches'][name]),
+                self.t.render(self.tree, tags, self.values)
+            )
+
+    def test_patches_only_hold_changes(self):
+        exported = export_variants(self.t, self.tree, ['beta'], {
+            'same': ['beta'],
+            'windows': ['beta', 'windows'],
+        })
+        self.assertEqual(exported['patches']['same'], {})
+        patch = exported['patches']['windows']
+        # The repeated snippet is one node, so it's only patched once,
+        # along with the nested branch and the filter.
+        self.assertEqual(sorted(patch), ['0', '2', '3'])
+        self.assertEqual(patch['0'], [0, 0, ['Run the installer.']])
+        self.assertEqual(patch['2'], [2, 0, ['so expect crashes']])
+        self.assertEqual(patch['3'], [3, 'Windows'])
+
+    def test_stats(self):
+        # The tree was compiled before the collector was attached.
+        self.t.stats = Stats()
+        export_variants(self.t, self.tree, [], {
+            'windows': ['windows'],
+            'mac': ['mac'],
+        })
+        nodes = self.t.stats.nodes
+        self.assertEqual(self.t.stats.renders, 3)
+        # The repeated snippet is hit twice per render.
+        self.assertEqual([c['hits'] for c in nodes[0]['clauses']], [2, 2, 2])
+        self.assertEqual([c['hits'] for c in nodes[1]['clauses']], [0])
+        self.assertEqual([c['hits'] for c in nodes[3]['clauses']], [1, 1, 0])
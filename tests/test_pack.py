@@ -0,0 +1,107 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from i17on import translator
+from i17on.pack import HEADER, Pack, PackError, write_pack
+
+SNIPPET = '{windows:Ctrl|-mac:Cmd|-Ctrl}'
+
+TEMPLATES = {
+    'intro': 'Hello {foo:world|-bar,!bizz;bazz:there}, you are on {=version}.',
+    'keys': 'Press ' + SNIPPET + '+C, then ' + SNIPPET + '+V.',
+    'list': 'Runs on {@list:{windows:Windows|-mac:macOS|-Linux}}.',
+    'join': '{@join(/):{a:ünïcødé|-b:b}}',
+    'empty': '',
+}
+
+
+class PackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'templates.pack')
+        self.t = translator.Translator()
+        write_pack(self.path, TEMPLATES)
+        self.pack = Pack(self.path)
+
+    def tearDown(self):
+        self.pack.close()
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        self.assertEqual(self.pack.names(), sorted(TEMPLATES))
+        for name, text in TEMPLATES.items():
+            self.assertEqual(self.pack.get(name), self.t.get_blocks(text))
+
+    def test_render(self):
+        self.assertEqual(
+            self.pack.render('intro', ['foo'], {'version': '2'}),
+            'Hello world, you are on 2.'
+        )
+        self.assertEqual(self.pack.render('list', ['mac']), 'Runs on macOS and Linux.')
+        self.assertEqual(self.pack.render('join', ['a', 'b']), 'ünïcødé/b')
+
+    def test_lazy_and_cached(self):
+        self.assertEqual(self.pack._trees, {})
+        tree = self.pack.get('keys')
+        self.assertEqual(list(self.pack._trees), ['keys'])
+        self.assertIs(self.pack.get('keys'), tree)
+
+    def test_shared_subtrees_stay_shared(self):
+        tree = self.pack.get('keys')
+        self.assertIs(tree[1], tree[3])
+
+    def test_missing_template(self):
+        self.assertNotIn('nope', self.pack)
+        with self.assertRaises(KeyError):
+            self.pack.get('nope')
+
+    def test_not_a_pack(self):
+        path = os.path.join(self.dir, 'bogus')
+        with open(path, 'wb') as f:
+            f.write(b'this is not a pack at all, not even close')
+        with self.assertRaises(PackError):
+            Pack(path)
+
+    def test_truncated_pack(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        path = os.path.join(self.dir, 'truncated')
+        for size in (0, 10, HEADER.size, HEADER.size + 20, len(data) // 2):
+            with open(path, 'wb') as f:
+                f.write(data[:size])
+            with self.assertRaises(PackError):
+                Pack(path)
+
+    def test_corrupt_header(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header = list(HEADER.unpack_from(data))
+        header[2] = 0xFFFFFFFF  # Far more templates than the file holds.
+        path = os.path.join(self.dir, 'corrupt')
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(*header) + data[HEADER.size:])
+        with self.assertRaises(PackError):
+            Pack(path)
+
+    def test_corrupt_code(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        code_at = HEADER.unpack_from(data)[7]
+        path = os.path.join(self.dir, 'corrupt')
+        for at in range(code_at, len(data), 4):
+            word = struct.unpack_from('<I', data, at)[0]
+            for bad in (word + 1, word + 1000, 0xFFFFFFFF):
+                bad &= 0xFFFFFFFF
+                with open(path, 'wb') as f:
+                    f.write(data[:at] + struct.pack('<I', bad) + data[at + 4:])
+                with Pack(path) as pack:
+                    for name in pack.names():
+                        # Some corruptions still decode to a valid tree,
+                        # but nothing else gets out.
+                        try:
+                            pack.get(name)
+                        except PackError:
+                            pass
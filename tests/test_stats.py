@@ -0,0 +1,126 @@
+import json
+import unittest
+from i17on import translator
+from i17on.stats import Stats, StatsMismatch
+
+TEXT = """Intro.
+
+{windows:
+    Press Ctrl.
+|-mac:
+    Press Cmd.
+|-
+    Press something.
+}
+
+{@list:{a:apples|-b:bananas}}
+"""
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = Stats()
+        self.t = translator.Translator()
+        self.t.stats = self.stats
+
+    def render(self, tree, *tags):
+        self.t._include_tags = list(tags)
+        return self.t.render(tree)
+
+    def test_clause_hits(self):
+        tree = self.t.get_blocks(TEXT)
+        self.render(tree, 'mac')
+        self.render(tree, 'mac', 'a')
+        self.render(tree)
+        branch, filter_node = self.stats.nodes
+        self.assertEqual(branch['type'], 'BRANCH')
+        self.assertEqual([c['hits'] for c in branch['clauses']], [0, 2, 1])
+        self.assertEqual(filter_node['type'], 'FILTER')
+        self.assertEqual([c['hits'] for c in filter_node['clauses']], [1, 0])
+        self.assertEqual(self.stats.renders, 3)
+
+    def test_source_lines(self):
+        self.t.get_blocks(TEXT)
+        branch, filter_node = self.stats.nodes
+        self.assertEqual(branch['lines'], [3])
+        self.assertEqual([c['lines'] for c in branch['clauses']], [[3], [5], [7]])
+        self.assertEqual(filter_node['lines'], [11])
+        self.assertEqual([b['lines'] for b in self.stats.blocks], [[1], [3], [11]])
+
+    def test_shared_subtrees_list_every_line(self):
+        self.t.get_blocks('{a:x}\n\nthen\n\n{a:x}')
+        self.assertEqual(len(self.stats.nodes), 1)
+        self.assertEqual(self.stats.nodes[0]['lines'], [1, 5])
+
+    def test_never_taken(self):
+        tree = self.t.get_blocks(TEXT)
+        self.render(tree, 'windows', 'b')
+        never = [(n['id'], c['condition']) for n, c in self.stats.never_taken()]
+        self.assertEqual(never, [(0, 'mac'), (0, ''), (1, 'a')])
+        self.assertIn('line 5: {mac} (branch 0)', self.stats.report())
+        self.assertIn('line 7: {(default)} (branch 0)', self.stats.report())
+
+    def test_block_timing(self):
+        tree = self.t.get_blocks(TEXT)
+        self.render(tree)
+        self.assertEqual(len(self.stats.blocks), 3)
+        self.assertTrue(all(b['seconds'] >= 0 for b in self.stats.blocks))
+        self.assertTrue(len(self.stats.hottest(2)) <= 2)
+
+    def test_json_round_trip(self):
+        tree = self.t.get_blocks(TEXT)
+        self.render(tree, 'mac')
+        data = self.stats.to_json()
+        self.assertEqual(json.loads(data)['renders'], 1)
+
+        # A later run over the same document picks up where it left off.
+        stats = Stats()
+        stats.load(data)
+        t = translator.Translator(mac=True)
+        t.stats = stats
+        t.translate(TEXT)
+        self.assertEqual(stats.renders, 2)
+        self.assertEqual(stats.nodes[0]['clauses'][1]['hits'], 2)
+
+    def test_untracked_tree(self):
+        # Trees compiled without stats get numbered on their first render.
+        tree = translator.Translator().get_blocks(TEXT)
+        self.render(tree, 'windows')
+        self.assertEqual(self.stats.nodes[0]['clauses'][0]['hits'], 1)
+        self.assertEqual(self.stats.nodes[0]['lines'], [])
+
+    def test_memoized_repeats_are_counted(self):
+        tree = self.t.get_blocks('a {x:X|-Y} b {x:X|-Y} c {x:X|-Y} d {x:X|-Y}')
+        self.assertEqual(self.render(tree), 'a Y b Y c Y d Y')
+        self.assertEqual([c['hits'] for c in self.stats.nodes[0]['clauses']], [0, 4])
+        self.t.expand_tree(tree)
+        self.assertEqual([c['hits'] for c in self.stats.nodes[0]['clauses']], [0, 8])
+
+    def test_memoized_nested_clauses_are_counted(self):
+        tree = self.t.get_blocks('{a:{b:B|-C}} then {a:{b:B|-C}}')
+        self.render(tree, 'a')
+        outer, inner = self.stats.nodes
+        self.assertEqual([c['hits'] for c in outer['clauses']], [2])
+        self.assertEqual([c['hits'] for c in inner['clauses']], [0, 2])
+
+    def test_other_document_is_refused(self):
+        tree = self.t.get_blocks(TEXT)
+        self.render(tree, 'mac')
+        data = self.stats.to_json()
+        self.assertRaises(StatsMismatch, Stats().load, data, TEXT + 'edited')
+        stats = Stats()
+        stats.load(data, TEXT)
+        self.assertEqual(stats.renders, 1)
+
+        # Compiling a different document starts the counts over.
+        self.t.get_blocks('{mac:Cmd|-Ctrl}')
+        self.assertEqual(self.stats.renders, 0)
+        self.assertEqual(self.stats.nodes[0]['clauses'][0]['hits'], 0)
+        self.assertRaises(StatsMismatch, self.stats.load, data)
+
+    def test_identical_filter_clauses(self):
+        tree = self.t.get_blocks('{@join(/):{a:x|-a:x}}')
+        self.assertEqual(self.render(tree, 'a'), 'x/x')
+        self.assertEqual([c['hits'] for c in self.stats.nodes[0]['clauses']], [1, 1])
+        self.assertEqual(self.stats.never_taken(), [])
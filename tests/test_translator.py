@@ -1,4 +1,11 @@
+import io
+import sys
+import copy
+import pickle
+import asyncio
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from i17on import translator
 
 class TranslatorTest(unittest.TestCase):
@@ -551,3 +558,340 @@ class TranslatorTest(unittest.TestCase):
             ['foo', 'bar'],
             'foo/bar/bazz'
         )
+
+    def test_whitespace_golden_output(self):
+        # Output captured before whitespace squashing moved into the
+        # lexer; every span should still normalize exactly as it did.
+        cases = [
+            ('Hello {foo:world}', ['foo'], 'Hello world'),
+            ('Hello {foo:world}', [], 'Hello'),
+            ('Hello {foo:this is foo|-bar:this is bar|-world}.', ['bar'], 'Hello this is bar.'),
+            ('Hello {\n\tfoo:\n\t\tthis is foo\n\t|-bar:\n\t    this is bar\n\t|-\n\t\tworld\n}.', [], 'Hello world.'),
+            ('Hello {\n\tfoo:\n\t\tthis is foo {bar:and bar}\n\t|-\n\t\tworld\n}.', ['foo', 'bar'], 'Hello this is foo and bar.'),
+            ('\n\nFirst paragraph\nwraps here.\n\n\n{foo:\n\n    Second paragraph.\n\n}\n\nThird\nparagraph, trailing.\n\n', ['foo'], '\n\nFirst paragraph wraps here.\n\n\n\nSecond paragraph.\n\n\n\nThird paragraph, trailing.\n\n'),
+            ('\n\nFirst paragraph\nwraps here.\n\n\n{foo:\n\n    Second paragraph.\n\n}\n\nThird\nparagraph, trailing.\n\n', [], '\n\nFirst paragraph wraps here.\n\n\n\nThird paragraph, trailing.\n\n'),
+            ('a {foo:b}\n\n\n{bar:c}\n  , d {foo:e}  \n\n', ['foo', 'bar'], 'a b c, d e'),
+            ('a {foo:b}\n\n\n{bar:c}\n  , d {foo:e}  \n\n', [], 'a, d'),
+            ('{foo:x}{bar:y}{foo:z}', ['foo', 'bar'], 'x y z'),
+            ('  {foo:x}  \n  {bar:y}  \n\n  ', ['foo', 'bar'], 'x y'),
+            ('line one\n! exclaim\n? question\n, comma\n. period', [], 'line one! exclaim? question, comma. period'),
+            ('{@list:{foo:foo|-bar:bar|-bazz}}\n\nand {@join(/):{foo:a|-b}}.', ['foo', 'bar'], 'foo, bar, and bazz\n\nand a/b.'),
+        ]
+        for text, tags, expected in cases:
+            self.assertTranslation(text, tags, expected)
+
+    def test_compile_empty_spans(self):
+        self.assertEqual(self.t.get_blocks(''), [])
+        self.assertEqual(self.t.get_blocks(' \n\n\t'), [])
+        self.assertEqual(
+            self.t.get_blocks('{foo:}  \n\n'),
+            [('BRANCH', [('WHEN', [['foo']], [])])]
+        )
+        self.assertTranslation('{foo:} bar', ['foo'], 'bar')
+
+    def test_compile_interns_identical_subtrees(self):
+        snippet = '{windows:Press Ctrl.|-mac:Press Cmd.|-linux:Press Ctrl.}'
+        blocks = self.t.get_blocks('One. ' + snippet + '\n\nTwo. ' + snippet)
+        self.assertIs(blocks[1], blocks[3])
+        # Identical clauses are shared even between different branches.
+        whens = blocks[1][1]
+        self.assertIs(whens[0][2][0], whens[2][2][0])
+        self.assertEqual(blocks[1], self.t.compile_branch(snippet[1:-1]))
+
+    def test_render_memoizes_shared_subtrees(self):
+        expanded = []
+
+        class CountingTranslator(translator.Translator):
+            def expand_branch(self, node):
+                expanded.append(node)
+                return super().expand_branch(node)
+
+        t = CountingTranslator(mac=True)
+        snippet = '{windows:Ctrl|-mac:Cmd|-Ctrl}'
+        tree = t.get_blocks(snippet + ' then ' + snippet + ' again')
+        self.assertEqual(t.render(tree), 'Cmd then Cmd again')
+        self.assertEqual(len(expanded), 1)
+        # Memoization only lasts for a single render.
+        t.add_tag('windows')
+        self.assertEqual(t.render(tree), 'Ctrl then Ctrl again')
+        self.assertEqual(len(expanded), 2)
+
+    def test_depth_limit(self):
+        self.t.set_limits(max_depth=2)
+        self.assertEqual(len(self.t.get_blocks('{a:{b:deep enough}}')), 1)
+        with self.assertRaises(translator.LimitExceeded):
+            self.t.get_blocks('{a:{b:{c:too deep}}}')
+        # A failed compile doesn't leave the translator in a bad state.
+        self.assertEqual(len(self.t.get_blocks('{a:{b:deep enough}}')), 1)
+
+    def test_node_limit(self):
+        text = '{' + '|-'.join('tag%d:clause %d' % (i, i) for i in range(50)) + '}'
+        self.t.set_limits(max_nodes=100)
+        with self.assertRaises(translator.LimitExceeded):
+            self.t.get_blocks(text)
+        self.t.set_limits(max_nodes=200)
+        self.assertEqual(len(self.t.get_blocks(text)[0][1]), 50)
+
+    def test_output_limit(self):
+        text = '{@join(/):{a:' + 'a' * 60 + '|-b:' + 'b' * 60 + '|-c:c}}'
+        self.t.add_tag('a', 'b', 'c')
+        self.t.set_limits(max_output=100)
+        with self.assertRaises(translator.LimitExceeded):
+            self.t.translate(text)
+        self.assertTranslation('hello {a:world}', ['a'], 'hello world')
+        self.t.set_limits(max_output=10)
+        with self.assertRaises(translator.LimitExceeded):
+            self.t.translate('hello {a:world}')
+
+    def test_time_limit(self):
+        tree = self.t.get_blocks('{a:slow|-fast}')
+        self.t.set_limits(time_limit=0)
+        with self.assertRaises(translator.LimitExceeded):
+            self.t.render(tree)
+        self.t.set_limits(time_limit=60)
+        self.assertEqual(self.t.render(tree), 'fast')
+
+    def test_render_tag_list(self):
+        tree = self.t.get_blocks('{foo:hello|-bar:hi} world')
+        self.assertEqual(self.t.render(tree, ['bar']), 'hi world')
+        self.assertEqual(translator.translate('{foo:hello} world', ['foo']), 'hello world')
+        self.assertEqual(self.t.translate('{foo:hello} world', tags=['foo']), 'hello world')
+        with self.assertRaises(TypeError):
+            self.t.translate('{foo:hello} world', False, ['foo'])
+
+    def test_render_tag_mapping(self):
+        tree = self.t.get_blocks('{foo:hello|-bar:hi} world')
+        self.assertEqual(self.t.render(tree, {'foo': False, 'bar': True}), 'hi world')
+        self.assertEqual(self.t.render(tree, {'foo': 1}), 'hello world')
+
+    def test_render_resolver_is_lazy_and_memoized(self):
+        asked = []
+
+        def resolver(tag):
+            asked.append(tag)
+            return tag in ('b', 'c')
+
+        text = '{a:A|-b:B|-c:C} {a,c:AC|-!b:not B|-b;c:B or C} {d:D|-b:B}'
+        tree = self.t.get_blocks(text)
+        self.assertEqual(self.t.render(tree, resolver), 'B B or C B')
+        self.assertEqual(asked, ['a', 'b', 'd'])
+        # Answers only last for one render.
+        self.t.render(tree, resolver)
+        self.assertEqual(asked, ['a', 'b', 'd'] * 2)
+
+    def test_compile_slot(self):
+        blocks = self.t.get_blocks('Version {= product_version }.')
+        self.assertEqual(blocks, [
+            ('TEXT', 'Version'),
+            ('SLOT', 'product_version'),
+            ('TEXT', '.')
+        ])
+
+    def test_render_slots(self):
+        text = 'Hi {=name}, {pro:your limit is {=limit}|-upgrade now}.'
+        tree = self.t.get_blocks(text)
+        self.assertEqual(
+            self.t.render(tree, ['pro'], {'name': 'Ann', 'limit': 50}),
+            'Hi Ann, your limit is 50.'
+        )
+        self.assertEqual(
+            self.t.render(tree, [], {'name': 'Bo'}),
+            'Hi Bo, upgrade now.'
+        )
+        # Missing values are left empty.
+        self.assertEqual(self.t.render(tree, ['pro']), 'Hi, your limit is.')
+
+    def test_render_into(self):
+        text = (
+            'Hi {=name}, {pro:your {a:limit|-quota} is {=limit}|-upgrade}.'
+            '\n\n{@list:{a:apples|-b:bananas|-pears}} '
+            '{a:(same {b:twice}) (same {b:twice})}'
+        )
+        tree = self.t.get_blocks(text)
+        values = {'name': 'Ann', 'limit': 5}
+        cases = [
+            ([], 'Hi Ann, upgrade.\n\npears'),
+            (['pro'], 'Hi Ann, your quota is 5.\n\npears'),
+            (['pro', 'a'], 'Hi Ann, your limit is 5.\n\napples and pears (same ) (same )'),
+            (['a', 'b'], 'Hi Ann, upgrade.\n\napples, bananas, and pears (same twice ) (same twice )'),
+            (['b'], 'Hi Ann, upgrade.\n\nbananas and pears'),
+        ]
+        for tags, expected in cases:
+            out = io.StringIO()
+            self.t.render_into(out, tree, tags, values)
+            self.assertEqual(out.getvalue(), expected)
+            # The old string-building expansion agrees.
+            with translator.rendering(self.t.start_render(tags, values)):
+                self.assertEqual(self.t.expand_tree(tree), expected)
+
+    def test_render_into_writes_fragments(self):
+        fragments = []
+
+        class Sink():
+            def write(self, text):
+                fragments.append(text)
+
+        tree = self.t.get_blocks('Hello {foo:big {bar:wide}} world.')
+        self.t.render_into(Sink(), tree, ['foo', 'bar'])
+        self.assertEqual(
+            fragments,
+            ['Hello', ' ', 'big', ' ', 'wide', ' ', 'world.']
+        )
+
+    def test_filters_get_items_lazily(self):
+        class FirstTranslator(translator.Translator):
+            def filter_first(self, _, items):
+                return next(items)
+
+        t = FirstTranslator()
+        expanded = []
+        expand_tree = t.expand_tree
+
+        def counting_expand_tree(tree):
+            expanded.append(tree)
+            return expand_tree(tree)
+
+        t.expand_tree = counting_expand_tree
+        tree = t.get_blocks('{@first:{a:A|-b:B|-C}}')
+        self.assertEqual(t.render(tree, ['a', 'b']), 'A')
+        # Only the first item was ever expanded.
+        self.assertEqual(expanded, [[('TEXT', 'A')]])
+
+    def test_pickle_and_copy(self):
+        self.t.add_tag('a')
+        self.t.set_limits(max_depth=5)
+        for t in (pickle.loads(pickle.dumps(self.t)), copy.deepcopy(self.t)):
+            self.assertEqual(t.translate('{a:hello} world'), 'hello world')
+            self.assertEqual(t.max_depth, 5)
+
+    def test_render_from_many_threads(self):
+        text = ' '.join(
+            '{a:A%d {c:C|-c2}|-b:B|-none} {@list:{a:x|-b:y|-z}} {=name}' % i
+            for i in range(20)
+        )
+        self.t.set_limits(time_limit=60)
+        tree = self.t.get_blocks(text)
+        profiles = [['a'], ['b'], ['a', 'c'], []]
+        expected = [self.t.render(tree, tags, {'name': i}) for i, tags in enumerate(profiles)]
+        outputs = {i: [] for i in range(len(profiles))}
+        errors = []
+        barrier = threading.Barrier(len(profiles))
+
+        def render(i):
+            barrier.wait()
+            try:
+                for _ in range(30):
+                    outputs[i].append(self.t.render(tree, profiles[i], {'name': i}))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=render, args=(i,)) for i in outputs]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Switch threads as often as possible.
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        for i, rendered in outputs.items():
+            self.assertEqual(rendered, [expected[i]] * 30)
+
+
+class AsyncTranslatorTest(unittest.IsolatedAsyncioTestCase):
+
+    text = 'Intro. {foo:Foo|-default} trailing {bar:bar}.\n\n{@list:{foo:a|-b}}'
+
+    def setUp(self):
+        self.t = translator.Translator()
+
+    async def test_render_async(self):
+        for tags in [[], ['foo'], ['foo', 'bar']]:
+            expected = self.t.render(self.t.get_blocks(self.text), tags)
+            self.assertEqual(await self.t.render_async(self.text, tags), expected)
+            tree = self.t.get_blocks(self.text)
+            self.assertEqual(await self.t.render_async(tree, tags), expected)
+
+    async def test_chunks_per_block(self):
+        chunks = [c async for c in self.t.iter_render_async(self.text, ['foo'])]
+        self.assertEqual(chunks, ['Intro.', ' Foo', ' trailing', '.\n\n', 'a and b'])
+
+    async def test_interleaved_renders(self):
+        tree = self.t.get_blocks(self.text)
+        foo = self.t.iter_render_async(tree, ['foo', 'bar'])
+        plain = self.t.iter_render_async(tree, [])
+        outputs = {'foo': [], 'plain': []}
+        for _ in range(len(tree)):
+            for name, chunks in (('foo', foo), ('plain', plain)):
+                try:
+                    outputs[name].append(await chunks.__anext__())
+                except StopAsyncIteration:
+                    pass
+        self.assertEqual(''.join(outputs['foo']), self.t.render(tree, ['foo', 'bar']))
+        self.assertEqual(''.join(outputs['plain']), self.t.render(tree, []))
+
+    async def test_concurrent_compiles_are_coalesced(self):
+        compiled = []
+        release = threading.Event()
+
+        class SlowTranslator(translator.Translator):
+            def get_blocks(self, text, **kwargs):
+                if translator.current_compile.get() is None:
+                    compiled.append(threading.current_thread().name)
+                    release.wait(5)
+                return super().get_blocks(text, **kwargs)
+
+        t = SlowTranslator()
+        t.executor = ThreadPoolExecutor(thread_name_prefix='i17on-compile')
+        try:
+            renders = [t.render_async(self.text, ['foo']) for _ in range(5)]
+            renders.append(t.render_async('something {bar:else}', ['bar']))
+            gathered = asyncio.gather(*renders)
+            await asyncio.sleep(0.05)
+            release.set()
+            outputs = await gathered
+        finally:
+            t.executor.shutdown()
+        self.assertEqual(len(compiled), 2)
+        self.assertTrue(all(name.startswith('i17on-compile') for name in compiled))
+        self.assertEqual(outputs[:5], [outputs[0]] * 5)
+        self.assertEqual(outputs[5], 'something else')
+        self.assertEqual(t._compiling, {})
+
+    async def test_sync_compile_during_async_compile(self):
+        paused = threading.Event()
+        release = threading.Event()
+
+        class PausingTranslator(translator.Translator):
+            def get_blocks(self, text, **kwargs):
+                # Pause the executor's compile two tags deep.
+                on_executor = threading.current_thread().name.startswith('i17on')
+                state = translator.current_compile.get()
+                depth = state.depth if state is not None else 0
+                if on_executor and depth == 2 and not release.is_set():
+                    paused.set()
+                    release.wait(5)
+                return super().get_blocks(text, **kwargs)
+
+        t = PausingTranslator(a=True, b=True)
+        t.set_limits(max_depth=3)
+        t.executor = ThreadPoolExecutor(thread_name_prefix='i17on')
+        text = '{a:{b:c}} {a:{b:c}}'
+        try:
+            render = asyncio.ensure_future(t.render_async(text))
+            await asyncio.get_running_loop().run_in_executor(None, paused.wait, 5)
+            threading.Timer(0.05, release.set).start()
+            self.assertEqual(t.translate(text), 'c c')
+            self.assertEqual(await render, 'c c')
+        finally:
+            t.executor.shutdown()
+
+    async def test_suspended_time_is_not_charged(self):
+        self.t.set_limits(time_limit=0.2)
+        chunks = []
+        async for chunk in self.t.iter_render_async(self.text, ['foo']):
+            chunks.append(chunk)
+            await asyncio.sleep(0.1)  # A slow consumer.
+        self.assertEqual(len(chunks), 5)
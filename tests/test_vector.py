@@ -0,0 +1,81 @@
+import itertools
+import unittest
+from i17on import translator
+from i17on import vector
+
+TEXT = """
+{a,!b:A not B|-b;c:B or C|-neither}
+{c:
+    C, {a:and A|-without A}
+}
+{@list:{a:a|-b:b|-c:c}}
+"""
+
+TAGS = ['a', 'b', 'c']
+
+
+@unittest.skipIf(vector.numpy is None, "NumPy isn't installed")
+class VectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.t = translator.Translator()
+        self.tree = self.t.get_blocks(TEXT)
+        # Every combination of the three tags.
+        self.profiles = list(itertools.product([False, True], repeat=3))
+
+    def test_selection_matrix(self):
+        clauses, selected = vector.evaluate(self.tree, TAGS, self.profiles)
+        self.assertEqual(clauses, [
+            (0, 0), (0, 1), (0, 2),
+            (1, 0),
+            (2, 0), (2, 1),
+            (3, 0), (3, 1), (3, 2),
+        ])
+        self.assertEqual(selected.shape, (8, 9))
+        # Profile 0 has no tags set, profile 5 has a and c.
+        self.assertEqual(list(selected[0]), [
+            False, False, True,
+            False,
+            False, False,
+            False, False, False
+        ])
+        self.assertEqual(list(selected[5]), [
+            True, False, False,
+            True,
+            True, False,
+            True, False, True
+        ])
+
+    def test_matches_rendering_each_profile(self):
+        clauses, selected = vector.evaluate(self.tree, TAGS, self.profiles)
+        for row, profile in enumerate(self.profiles):
+            tags = [tag for tag, on in zip(TAGS, profile) if on]
+            skeleton = self.t.render_skeleton(self.tree, tags)
+            seen = set()
+
+            def walk(entries):
+                for entry in entries:
+                    if isinstance(entry, str):
+                        continue
+                    if len(entry) == 3 and entry[1] is not None:
+                        seen.add((entry[0], entry[1]))
+                        walk(entry[2])
+
+            walk(skeleton)
+            expected = set(c for c, on in zip(clauses, selected[row]) if on)
+            # Filter clauses aren't in skeletons; just check branches.
+            self.assertEqual(seen, set(c for c in expected if c[0] != 3))
+
+    def test_unknown_tags_are_unset(self):
+        _, selected = vector.evaluate(self.tree, ['zzz'], [[True], [False]])
+        self.assertEqual(selected[0].tolist(), selected[1].tolist())
+
+    def test_group_renders(self):
+        groups = vector.group_renders(self.t, self.tree, TAGS, self.profiles)
+        covered = []
+        for text, rows in groups:
+            for row in rows:
+                tags = [tag for tag, on in zip(TAGS, self.profiles[row]) if on]
+                self.assertEqual(text, self.t.render(self.tree, tags))
+                covered.append(row)
+        self.assertEqual(sorted(covered), list(range(8)))